@@ -1,14 +1,32 @@
 #!/usr/bin/env python
-try:
-    from graphviz import Digraph
-except ImportError:
-    pass
-
 import queue as Queue
+import threading
+import time
 
 import nfa
 
 
+class BudgetExceeded(Exception):
+    """Raised by nfa_to_dfa when the subset construction exceeds its Limits"""
+
+
+class Limits(object):
+    """Resource budget for the subset construction
+
+    Any of the members may be None, meaning that resource is not limited:
+
+        - "max_states": maximum number of DFA states
+        - "max_transitions": maximum number of entries in the DFA "delta"
+        - "max_time": maximum wall time of the construction, in seconds
+
+    """
+    def __init__(self, max_states=None, max_transitions=None, max_time=None):
+        """See class docstring"""
+        self.max_states = max_states
+        self.max_transitions = max_transitions
+        self.max_time = max_time
+
+
 class DFA(object):
     """Model a Nondeterministic Finite Automaton
 
@@ -38,7 +56,37 @@ class DFA(object):
         self.delta = delta
         self.sink_state = None
 
+    def accepts(self, word, stats=None):
+        """Simulate the automaton on "word"
+
+        The transition function is not total: a missing transition means
+        that the (implicit) sink state was reached, so the word is rejected
+        without consuming the rest of it.
+
+        """
+        crt = self.start_state
+        delta = self.delta
+        if stats is None:
+            for c in word:
+                crt = delta.get((crt, c))
+                if crt is None:
+                    return False
+            return crt in self.final_states
+
+        consumed = 0
+        for c in word:
+            consumed += 1
+            crt = delta.get((crt, c))
+            if crt is None:
+                stats.count("chars_consumed", consumed)
+                stats.count("early_exits")
+                return False
+        stats.count("chars_consumed", consumed)
+        return crt in self.final_states
+
     def to_graphviz(self):
+        from graphviz import Digraph
+
         def get_edges(delta):
             edges = {}
             for (prev_state, symbol), next_state in delta.items():
@@ -95,7 +143,9 @@ class DFA(object):
         return dot
 
 
-def get_epsilon_closure(nfa, state):
+def get_epsilon_closure(nfa, state, stats=None):
+    if stats is not None:
+        stats.count("epsilon_closure_calls")
     epsilon_closure = set()
     queue = Queue.Queue(maxsize=0)
     next_states = nfa.delta.get((state, '&'))
@@ -118,7 +168,16 @@ def get_epsilon_closure(nfa, state):
     return epsilon_closure
 
 
-def nfa_to_dfa(nfa):
+def check_limits(limits, dfa_states, dfa_delta):
+    if limits.max_states is not None and len(dfa_states) > limits.max_states:
+        raise BudgetExceeded("more than {} DFA states".format(limits.max_states))
+    if limits.max_transitions is not None and \
+       len(dfa_delta) > limits.max_transitions:
+        raise BudgetExceeded("more than {} DFA transitions".format(
+            limits.max_transitions))
+
+
+def nfa_to_dfa(nfa, stats=None, limits=None):
 
     """print(nfa.alphabet)
     print(nfa.start_state)
@@ -131,29 +190,226 @@ def nfa_to_dfa(nfa):
         if c != '&':
             dfa_alphabet = dfa_alphabet + c
 
+    if limits is not None and limits.max_time is not None:
+        deadline = time.monotonic() + limits.max_time
+    else:
+        deadline = None
+    closures = {}
+
     dfa_states = set()
-    dfa_start_state = frozenset(get_epsilon_closure(nfa, nfa.start_state))
+    dfa_start_state = frozenset(get_epsilon_closure(nfa, nfa.start_state, stats))
     dfa_states.add(dfa_start_state)
     dfa_final_states = set()
     dfa_delta = {}
     queue = Queue.Queue(maxsize=0)
-    queue.put(get_epsilon_closure(nfa, nfa.start_state))
+    queue.put(get_epsilon_closure(nfa, nfa.start_state, stats))
     while not queue.empty():
         crt = queue.get()
         for symbol in dfa_alphabet:
+            if deadline is not None and time.monotonic() > deadline:
+                raise BudgetExceeded("compile time exceeded {}s".format(limits.max_time))
             next_state = set()
             for state in crt:
                 if (state, symbol) in nfa.delta:
                     new_states = nfa.delta.get((state, symbol))
                     for x in new_states:
-                        next_state.update(get_epsilon_closure(nfa, x))
+                        if x not in closures:
+                            closures[x] = get_epsilon_closure(nfa, x, stats)
+                        next_state.update(closures[x])
             if not next_state == set():
                 dfa_delta.update({(frozenset(crt), symbol): frozenset(next_state)})
                 if not next_state in dfa_states:
                     queue.put(next_state)
                 dfa_states.add(frozenset(next_state))
+                if limits is not None:
+                    check_limits(limits, dfa_states, dfa_delta)
     for f_state in nfa.final_states:
         for state in dfa_states:
             if f_state in state:
                 dfa_final_states.add(state)
-    return DFA(dfa_alphabet, dfa_states, dfa_start_state, dfa_final_states, dfa_delta)
\ No newline at end of file
+    if stats is not None:
+        stats.set("dfa_states", len(dfa_states))
+        stats.set("dfa_transitions", len(dfa_delta))
+    return DFA(dfa_alphabet, dfa_states, dfa_start_state, dfa_final_states, dfa_delta)
+
+
+def minimize(dfa, stats=None):
+    """Build the minimal DFA accepting the same language as "dfa"
+
+    States that cannot be reached from the start state are dropped, and so
+    are states from which no final state is reachable (they are equivalent
+    to the implicit sink state). The remaining states are split by Moore's
+    partition refinement. The states of the result are renumbered to
+    non-negative integers, the start state being 0.
+
+    """
+    forward = {}
+    for (state, symbol), next_state in dfa.delta.items():
+        forward.setdefault(state, set()).add(next_state)
+    reachable = {dfa.start_state}
+    stack = [dfa.start_state]
+    while stack:
+        state = stack.pop()
+        for next_state in forward.get(state, ()):
+            if next_state not in reachable:
+                reachable.add(next_state)
+                stack.append(next_state)
+
+    reverse = {}
+    for (state, symbol), next_state in dfa.delta.items():
+        if state in reachable:
+            reverse.setdefault(next_state, set()).add(state)
+    live = dfa.final_states & reachable
+    stack = list(live)
+    while stack:
+        state = stack.pop()
+        for prev_state in reverse.get(state, ()):
+            if prev_state not in live:
+                live.add(prev_state)
+                stack.append(prev_state)
+
+    states = live | {dfa.start_state}
+    delta = {(state, symbol): next_state
+             for (state, symbol), next_state in dfa.delta.items()
+             if state in states and next_state in live}
+
+    block = {state: int(state in dfa.final_states) for state in states}
+    n_blocks = len(set(block.values()))
+    while True:
+        signatures = {}
+        new_block = {}
+        for state in states:
+            signature = (block[state],) + tuple(
+                block.get(delta.get((state, symbol)), -1)
+                for symbol in dfa.alphabet)
+            new_block[state] = signatures.setdefault(signature, len(signatures))
+        block = new_block
+        if len(signatures) == n_blocks:
+            break
+        n_blocks = len(signatures)
+
+    # Renumber the blocks so that the start state is 0 and the numbering does
+    # not depend on set iteration order.
+    numbering = {block[dfa.start_state]: 0}
+    order = [dfa.start_state]
+    i = 0
+    while i < len(order):
+        state = order[i]
+        i += 1
+        for symbol in sorted(dfa.alphabet):
+            next_state = delta.get((state, symbol))
+            if next_state is not None and block[next_state] not in numbering:
+                numbering[block[next_state]] = len(numbering)
+                order.append(next_state)
+
+    min_states = set(numbering.values())
+    min_final_states = {numbering[block[state]] for state in dfa.final_states
+                        if state in states}
+    min_delta = {(numbering[block[state]], symbol): numbering[block[next_state]]
+                 for (state, symbol), next_state in delta.items()}
+    if stats is not None:
+        stats.set("dfa_states_minimized", len(min_states))
+        stats.set("dfa_transitions_minimized", len(min_delta))
+    return DFA(dfa.alphabet, min_states, 0, min_final_states, min_delta)
+
+
+class LazyDFA(object):
+    """Simulate an NFA by determinizing it on demand
+
+    DFA states (sets of NFA states) are only built when a word reaches them
+    and the transitions between them are cached. The cache holds at most
+    "max_cached_transitions" (subset, symbol) entries; when it is full the
+    oldest entry is evicted, so memory stays bounded no matter how many
+    subsets the NFA has. It exposes the same "accepts" method as DFA and is
+    used as the fallback engine when nfa_to_dfa exceeds its Limits.
+
+    """
+    def __init__(self, nfa, max_cached_transitions=10000):
+        """See class docstring"""
+        self.nfa = nfa
+        self.max_cached_transitions = max_cached_transitions
+        self.closures = {}
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.start_state = frozenset(self.closure(nfa.start_state))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def closure(self, state):
+        closure = self.closures.get(state)
+        if closure is None:
+            closure = frozenset(get_epsilon_closure(self.nfa, state))
+            self.closures[state] = closure
+        return closure
+
+    def step(self, states, symbol):
+        key = (states, symbol)
+        next_states = self.cache.get(key)
+        if next_states is None:
+            next_states = set()
+            for state in states:
+                for x in self.nfa.delta.get((state, symbol), ()):
+                    next_states.update(self.closure(x))
+            next_states = frozenset(next_states)
+            with self.lock:
+                while self.cache and \
+                      len(self.cache) >= self.max_cached_transitions:
+                    del self.cache[next(iter(self.cache))]
+                self.cache[key] = next_states
+        return next_states
+
+    def accepts(self, word, stats=None):
+        crt = self.start_state
+        consumed = 0
+        for c in word:
+            consumed += 1
+            crt = self.step(crt, c)
+            if not crt:
+                if stats is not None:
+                    stats.count("chars_consumed", consumed)
+                    stats.count("early_exits")
+                return False
+        if stats is not None:
+            stats.count("chars_consumed", consumed)
+        return not crt.isdisjoint(self.nfa.final_states)
+
+
+def distinguishing_word(a, b):
+    """Return a shortest word accepted by exactly one of the DFAs, or None
+
+    This is a breadth-first search of the product automaton of "a" and "b";
+    a missing transition leads to the (non-final) sink state, represented
+    by None.
+
+    """
+    alphabet = sorted(set(a.alphabet) | set(b.alphabet))
+    start = (a.start_state, b.start_state)
+    parent = {start: None}
+    queue = Queue.Queue(maxsize=0)
+    queue.put(start)
+    while not queue.empty():
+        crt = queue.get()
+        x, y = crt
+        if (x in a.final_states) != (y in b.final_states):
+            word = []
+            while parent[crt] is not None:
+                crt, symbol = parent[crt]
+                word.append(symbol)
+            return "".join(reversed(word))
+        for symbol in alphabet:
+            next_state = (a.delta.get((x, symbol)), b.delta.get((y, symbol)))
+            if next_state not in parent:
+                parent[next_state] = (crt, symbol)
+                queue.put(next_state)
+    return None
+
+
+def equivalent(a, b):
+    return distinguishing_word(a, b) is None
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+import asyncio
+import json
+import random
+import re as PyRe
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dfa as Dfa
+import incremental
+import nfa as Nfa
+import pipeline
+import regex as Regex
+import regular_expression
+import service
+import stats as Stats
+
+SYMBOLS = "abc"
+WORD_SYMBOLS = "abcd"
+
+
+def random_regex(rng, depth):
+    """Generate a random RegEx TDA over SYMBOLS"""
+    if depth == 0 or rng.random() < 0.25:
+        kind = rng.random()
+        if kind < 0.1:
+            return Regex.RegEx(Regex.EMPTY_STRING)
+        if kind < 0.2:
+            symbol_set = set()
+            for _ in range(rng.randint(1, 2)):
+                x, y = sorted(rng.sample(SYMBOLS, 2))
+                symbol_set.add(rng.choice([x, (x, y)]))
+            return Regex.RegEx(Regex.SYMBOL_SET, symbol_set)
+        if kind < 0.22:
+            return Regex.RegEx(Regex.SYMBOL_ANY)
+        return Regex.RegEx(Regex.SYMBOL_SIMPLE, rng.choice(SYMBOLS))
+
+    kind = rng.choice([Regex.MAYBE, Regex.STAR, Regex.PLUS, Regex.RANGE,
+                       Regex.CONCATENATION, Regex.CONCATENATION,
+                       Regex.ALTERNATION, Regex.ALTERNATION])
+    lhs = random_regex(rng, depth - 1)
+    if kind == Regex.RANGE:
+        x = rng.randint(-1, 3)
+        y = rng.randint(max(x, 1), 3) if x == -1 or rng.random() < 0.7 else -1
+        return Regex.RegEx(kind, lhs, (x, y))
+    if kind in (Regex.CONCATENATION, Regex.ALTERNATION):
+        return Regex.RegEx(kind, lhs, random_regex(rng, depth - 1))
+    return Regex.RegEx(kind, lhs)
+
+
+def random_words(rng, count, max_length):
+    words = ["", "a", "b", "ab", "ba", "aab"]
+    for _ in range(count):
+        length = rng.randint(0, max_length)
+        words.append("".join(rng.choice(WORD_SYMBOLS) for _ in range(length)))
+    return words
+
+
+def to_python_re(regex):
+    """Translate a RegEx TDA to a Python "re" pattern
+
+    Returns None when the semantics differ: the reference pipeline turns
+    SYMBOL_SET and SYMBOL_ANY into an alternation that also contains the
+    empty string.
+
+    """
+    if regex.type == Regex.EMPTY_STRING:
+        return "(?:)"
+    if regex.type == Regex.SYMBOL_SIMPLE:
+        return regex.symbol
+    if regex.type in (Regex.SYMBOL_SET, Regex.SYMBOL_ANY):
+        return None
+
+    lhs = to_python_re(regex.lhs)
+    if lhs is None:
+        return None
+    if regex.type == Regex.MAYBE:
+        return "(?:{})?".format(lhs)
+    if regex.type == Regex.STAR:
+        return "(?:{})*".format(lhs)
+    if regex.type == Regex.PLUS:
+        return "(?:{})+".format(lhs)
+    if regex.type == Regex.RANGE:
+        x, y = regex.range
+        if x == -1:
+            return "(?:{}){{0,{}}}".format(lhs, y)
+        if y == -1:
+            return "(?:{}){{{},}}".format(lhs, x)
+        return "(?:{}){{{},{}}}".format(lhs, x, y)
+
+    rhs = to_python_re(regex.rhs)
+    if rhs is None:
+        return None
+    if regex.type == Regex.CONCATENATION:
+        return "(?:{})(?:{})".format(lhs, rhs)
+    return "(?:{}|{})".format(lhs, rhs)
+
+
+def reference_accepts(dfa, word):
+    """The matching loop main.py originally used"""
+    crt = dfa.start_state
+    for c in word:
+        crt = dfa.delta.get((crt, c))
+        if crt == None:
+            return False
+    return crt in dfa.final_states
+
+
+class Harness(object):
+    """Cross-check every engine against the reference pipeline
+
+    The reference is the unminimized nfa_to_dfa result simulated by the
+    original main.py loop. "timings" maps each engine to the total time
+    spent compiling and matching with it, and "failures" collects a message
+    for every disagreement.
+
+    """
+    def __init__(self):
+        """See class docstring"""
+        self.timings = {}
+        self.failures = []
+        self.cases = 0
+        self.re_cases = 0
+
+    def timed(self, engine, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.timings[engine] = self.timings.get(engine, 0.0) + \
+            time.perf_counter() - start
+        return result
+
+    def fail(self, regex, message):
+        self.failures.append("{!s}: {}".format(regex, message))
+
+    def check_results(self, regex, engine, words, expected, results):
+        for word, want, got in zip(words, expected, results):
+            if want != got:
+                self.fail(regex, "{} gives {} on {!r}, reference gives {}"
+                          .format(engine, got, word, want))
+                return
+
+    def check(self, regex, words):
+        self.cases += 1
+        re = self.timed("regex_to_regular_expression",
+                        regular_expression.regex_to_regular_expression, regex)
+        nfa = self.timed("re_to_nfa", Nfa.re_to_nfa, re)
+        reference = self.timed("nfa_to_dfa", Dfa.nfa_to_dfa, nfa)
+        expected = self.timed("reference match",
+                              lambda: [reference_accepts(reference, word)
+                                       for word in words])
+
+        minimized = self.timed("minimize", Dfa.minimize, reference)
+        word = Dfa.distinguishing_word(reference, minimized)
+        if word is not None:
+            self.fail(regex, "minimized DFA differs on {!r}".format(word))
+        again = Dfa.minimize(minimized)
+        if len(again.states) != len(minimized.states) or \
+           not Dfa.equivalent(again, minimized):
+            self.fail(regex, "minimization is not idempotent")
+        self.check_results(regex, "minimized DFA", words, expected,
+                           self.timed("minimized match",
+                                      lambda: [minimized.accepts(word)
+                                               for word in words]))
+
+        lazy = self.timed("lazy compile", pipeline.compile_regex, regex,
+                          None, True, Dfa.Limits(max_states=1))
+        if not isinstance(lazy, Dfa.LazyDFA) and len(reference.states) > 1:
+            self.fail(regex, "state budget was not enforced")
+        self.check_results(regex, "budget fallback", words, expected,
+                           self.timed("lazy match",
+                                      lambda: [lazy.accepts(word)
+                                               for word in words]))
+        self.check_limits(regex, reference, words, expected)
+        self.check_stats(regex, reference, minimized, words, expected)
+        self.check_distinguishing(regex, reference, words)
+
+        pattern = to_python_re(regex)
+        if pattern is not None:
+            self.re_cases += 1
+            compiled = PyRe.compile(pattern)
+            self.check_results(regex, "Python re", words, expected,
+                               self.timed("python re",
+                                          lambda: [compiled.fullmatch(word)
+                                                   is not None
+                                                   for word in words]))
+        return expected
+
+    def check_limits(self, regex, reference, words, expected):
+        """The transition and time budgets must trip and fall back as well"""
+        engines = [("transition budget", Dfa.Limits(max_transitions=0),
+                    len(reference.delta) > 0),
+                   ("time budget", Dfa.Limits(max_time=0.0),
+                    len(reference.alphabet) > 0)]
+        for engine, limits, must_trip in engines:
+            compiled = pipeline.compile_regex(regex, limits=limits)
+            if must_trip and not isinstance(compiled, Dfa.LazyDFA):
+                self.fail(regex, "{} was not enforced".format(engine))
+            self.check_results(regex, engine, words, expected,
+                               [compiled.accepts(word) for word in words])
+            try:
+                pipeline.compile_regex(regex, limits=limits, fallback=False)
+                if must_trip:
+                    self.fail(regex, "{} did not raise".format(engine))
+            except Dfa.BudgetExceeded:
+                if not must_trip:
+                    self.fail(regex, "{} raised needlessly".format(engine))
+
+    def check_stats(self, regex, reference, minimized, words, expected):
+        """Instrumented compilation must agree with the plain pipeline"""
+        stats = Stats.Stats()
+        compiled = self.timed("instrumented compile", pipeline.compile_regex,
+                              regex, stats)
+        counters = stats.counters
+        if counters.get("dfa_states") != len(reference.states) or \
+           counters.get("dfa_states_minimized") != len(minimized.states) or \
+           counters.get("regex_nodes") != Stats.tree_size(regex):
+            self.fail(regex, "wrong counters {}".format(counters))
+        if set(stats.stages) != {"regex_to_regular_expression", "re_to_nfa",
+                                 "nfa_to_dfa", "minimize"}:
+            self.fail(regex, "wrong stages {}".format(sorted(stats.stages)))
+        self.check_results(regex, "instrumented DFA", words, expected,
+                           [compiled.accepts(word, stats) for word in words])
+        if counters.get("chars_consumed", 0) > sum(len(w) for w in words):
+            self.fail(regex, "chars_consumed overcounts")
+
+    def check_distinguishing(self, regex, reference, words):
+        """distinguishing_word must find a word on which the DFAs differ"""
+        flipped = Dfa.DFA(reference.alphabet, reference.states,
+                          reference.start_state,
+                          reference.states - reference.final_states,
+                          reference.delta)
+        # L(regex) and L(regex)a always differ: the shortest words of the
+        # latter are one symbol longer than those of the former.
+        mutated = Regex.RegEx(Regex.CONCATENATION, regex,
+                              Regex.RegEx(Regex.SYMBOL_SIMPLE, "a"))
+        for name, other in [("flipped", flipped),
+                            ("mutated", pipeline.compile_regex(mutated))]:
+            word = self.timed("equivalence", Dfa.distinguishing_word,
+                              reference, other)
+            if word is None:
+                self.fail(regex, "no word distinguishes the {} DFA"
+                          .format(name))
+            elif reference_accepts(reference, word) == other.accepts(word):
+                self.fail(regex, "{!r} does not distinguish the {} DFA"
+                          .format(word, name))
+
+    def check_pattern_set(self, cases):
+        """Match all the cases through a single PatternSet"""
+        patterns = incremental.PatternSet()
+        for i, (regex, words, expected) in enumerate(cases):
+            self.timed("pattern set", patterns.add, i, regex)
+        for step in (0, 1):
+            for i, (regex, words, expected) in enumerate(cases):
+                if i in patterns:
+                    results = self.timed("pattern set",
+                                         lambda: [i in patterns.match(word)
+                                                  for word in words])
+                    self.check_results(regex, "pattern set", words, expected,
+                                       results)
+            # The odd patterns are checked again once the even ones are gone.
+            if step == 0:
+                for i in range(0, len(cases), 2):
+                    self.timed("pattern set", patterns.remove, i)
+
+    def check_service(self, cases):
+        """Match all the cases through the service, directly and through
+        its line protocol"""
+        async def run(svc):
+            async with svc:
+                direct = asyncio.gather(*[svc.match(regex, words)
+                                          for regex, words, _ in cases])
+                lines = asyncio.gather(*[
+                    service.handle_line(svc, json.dumps({
+                        "id": i,
+                        "pattern": service.regex_to_json(regex),
+                        "words": words}))
+                    for i, (regex, words, _) in enumerate(cases)])
+                return await direct, await lines
+
+        # The thread run caches automata in this process, where forked
+        # workers would inherit them; its own limits keep the keys apart, so
+        # the process run below still compiles everything in the workers.
+        with ThreadPoolExecutor() as executor:
+            self.check_service_run(cases, "service (threads)", run(
+                service.MatcherService(limits=Dfa.Limits(max_states=50),
+                                       executor=executor)))
+        # The default process pool, with a small pattern pool so that the
+        # workers evict and recompile automata.
+        self.check_service_run(cases, "service (processes)", run(
+            service.MatcherService(max_patterns=max(len(cases) // 4, 1))))
+
+    def check_service_keys(self):
+        """Trees with the same str() must not share automata in the service
+
+        For every postfix operator, op(a) and CONCATENATION(a,
+        op(EMPTY_STRING)) print the same (e.g. "a+") but accept different
+        words. They are sent together, so they also land in the same batch.
+
+        """
+        a = Regex.RegEx(Regex.SYMBOL_SIMPLE, "a")
+        empty = Regex.RegEx(Regex.EMPTY_STRING)
+        pairs = []
+        for type, obj2 in [(Regex.PLUS, None), (Regex.STAR, None),
+                           (Regex.MAYBE, None), (Regex.RANGE, (2, 2))]:
+            lhs = Regex.RegEx(type, a, obj2)
+            rhs = Regex.RegEx(Regex.CONCATENATION, a,
+                              Regex.RegEx(type, empty, obj2))
+            lhs_dfa = pipeline.compile_regex(lhs)
+            rhs_dfa = pipeline.compile_regex(rhs)
+            word = Dfa.distinguishing_word(lhs_dfa, rhs_dfa)
+            if str(lhs) != str(rhs) or word is None:
+                self.fail(lhs, "not a colliding pair with {}".format(rhs))
+                continue
+            words = [word, "", "a", "aa"]
+            pairs.append((lhs, words, [lhs_dfa.accepts(w) for w in words]))
+            pairs.append((rhs, words, [rhs_dfa.accepts(w) for w in words]))
+
+        async def run():
+            async with service.MatcherService() as svc:
+                return await asyncio.gather(*[svc.match(regex, words)
+                                              for regex, words, _ in pairs])
+
+        results = self.timed("service keys", asyncio.run, run())
+        for (regex, words, expected), got in zip(pairs, results):
+            self.check_results(regex, "service keys", words, expected, got)
+
+    def check_service_run(self, cases, engine, coroutine):
+        results, lines = self.timed(engine, asyncio.run, coroutine)
+        for (regex, words, expected), got in zip(cases, results):
+            self.check_results(regex, engine, words, expected, got)
+        for i, ((regex, words, expected), line) in enumerate(zip(cases, lines)):
+            response = json.loads(line)
+            if response.get("id") != i or "results" not in response:
+                self.fail(regex, "bad protocol response {}".format(line))
+                continue
+            self.check_results(regex, engine + " line protocol", words,
+                               expected, response["results"])
+
+    def report(self):
+        lines = ["{} cases ({} also checked against Python re), "
+                 "{} failures".format(self.cases, self.re_cases,
+                                      len(self.failures))]
+        for engine, seconds in sorted(self.timings.items()):
+            lines.append("\t{:<30} {:.3f}s".format(engine, seconds))
+        lines += self.failures
+        return "\n".join(lines)
+
+
+def run(iterations, seed=0, depth=4):
+    rng = random.Random(seed)
+    harness = Harness()
+    cases = []
+    for _ in range(iterations):
+        regex = random_regex(rng, depth)
+        words = random_words(rng, 20, 8)
+        cases.append((regex, words, harness.check(regex, words)))
+    harness.check_pattern_set(cases)
+    harness.check_service(cases)
+    harness.check_service_keys()
+    return harness
+
+
+if __name__ == "__main__":
+    valid = 2 <= len(sys.argv) <= 4
+    if not valid:
+        sys.stderr.write(
+            "Usage:\n"
+            "\tpython3 fuzz.py <iterations> [<seed>] [<time-budget>]\n"
+        )
+        sys.exit(1)
+
+    iterations = int(sys.argv[1])
+    seed = int(sys.argv[2]) if len(sys.argv) >= 3 else 0
+    start = time.perf_counter()
+    harness = run(iterations, seed)
+    elapsed = time.perf_counter() - start
+    print(harness.report())
+    print("total {:.3f}s".format(elapsed))
+
+    if harness.failures:
+        sys.exit(1)
+    if len(sys.argv) == 4 and elapsed > float(sys.argv[3]):
+        sys.stderr.write("time budget of {}s exceeded\n".format(sys.argv[3]))
+        sys.exit(2)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+import dfa as Dfa
+import nfa as Nfa
+import pipeline
+import regular_expression
+
+
+class PatternSet(object):
+    """Match words against a set of named RegEx TDAs that changes over time
+
+    Each pattern is converted to an NFA once, when it is added, and its
+    states are shifted into a block of state numbers that no other pattern
+    uses. The union automaton is state 0 with epsilon transitions to the
+    start state of every pattern; it is determinized lazily by a LazyDFA, so
+    only the subsets reached by the matched words are ever built.
+
+    Because the blocks are disjoint, adding or removing a pattern only
+    invalidates the cached subsets that contain state 0 (the start subset)
+    or states of the removed pattern; everything else is kept.
+
+    Standalone (minimized) DFAs for single patterns are compiled on demand
+    and cached as well.
+
+    """
+    def __init__(self, limits=None, max_cached_transitions=10000):
+        """See class docstring"""
+        self.limits = limits
+        self.patterns = {}
+        self.nfas = {}
+        self.dfas = {}
+        self.owner = {}
+        self.next_state = 1
+        self.nfa = Nfa.NFA("&", {0}, 0, set(), {})
+        self.lazy = Dfa.LazyDFA(self.nfa, max_cached_transitions)
+
+    def __contains__(self, name):
+        return name in self.patterns
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, name, regex):
+        # Convert first, so that a failure leaves the old pattern in place.
+        re = regular_expression.regex_to_regular_expression(regex)
+        nfa = Nfa.re_to_nfa(re)
+        if name in self.patterns:
+            self.remove(name)
+
+        Nfa.shift_states(nfa, self.next_state)
+        self.next_state = max(nfa.states) + 1
+
+        self.patterns[name] = regex
+        self.nfas[name] = nfa
+        for state in nfa.final_states:
+            self.owner[state] = name
+
+        self.nfa.alphabet = "".join(set(self.nfa.alphabet) | set(nfa.alphabet))
+        self.nfa.states |= nfa.states
+        self.nfa.final_states |= nfa.final_states
+        self.nfa.delta.update(nfa.delta)
+        self.update_start()
+        self.invalidate(set())
+
+    def remove(self, name):
+        del self.patterns[name]
+        self.dfas.pop(name, None)
+        nfa = self.nfas.pop(name)
+        for state in nfa.final_states:
+            del self.owner[state]
+
+        self.nfa.states -= nfa.states
+        self.nfa.final_states -= nfa.final_states
+        for key in nfa.delta:
+            del self.nfa.delta[key]
+        self.update_start()
+        self.invalidate(nfa.states)
+
+    def update_start(self):
+        starts = {nfa.start_state for nfa in self.nfas.values()}
+        if starts:
+            self.nfa.delta[(0, "&")] = starts
+        else:
+            self.nfa.delta.pop((0, "&"), None)
+
+    def invalidate(self, removed):
+        """Drop the cached subsets affected by a change of the pattern set"""
+        stale = removed | {0}
+        lazy = self.lazy
+        for state in stale:
+            lazy.closures.pop(state, None)
+        lazy.cache = {(states, symbol): next_states
+                      for (states, symbol), next_states in lazy.cache.items()
+                      if stale.isdisjoint(states) and
+                      removed.isdisjoint(next_states)}
+        lazy.start_state = lazy.closure(0)
+
+    def dfa(self, name):
+        """Return the compiled automaton of a single pattern"""
+        dfa = self.dfas.get(name)
+        if dfa is None:
+            dfa = pipeline.compile_regex(self.patterns[name],
+                                         limits=self.limits)
+            self.dfas[name] = dfa
+        return dfa
+
+    def match(self, word):
+        """Return the names of the patterns that accept the word"""
+        lazy = self.lazy
+        crt = lazy.start_state
+        for c in word:
+            crt = lazy.step(crt, c)
+            if not crt:
+                return set()
+        return {self.owner[state] for state in crt if state in self.owner}
+
+    def accepts(self, word):
+        return bool(self.match(word))
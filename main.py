@@ -2,21 +2,25 @@
 import sys
 import pickle
 
-import dfa
-import regular_expression
-import nfa as Nfa
 import parse
+import pipeline
+import stats as Stats
 
 
 if __name__ == "__main__":
+    stats = None
+    if "--stats" in sys.argv:
+        sys.argv.remove("--stats")
+        stats = Stats.Stats()
+
     valid = (len(sys.argv) == 4 and sys.argv[1] in ["RAW", "TDA"]) or \
             (len(sys.argv) == 3 and sys.argv[1] == "PARSE")
     if not valid:
         sys.stderr.write(
             "Usage:\n"
-            "\tpython3 main.py RAW <regex-str> <words-file>\n"
+            "\tpython3 main.py RAW <regex-str> <words-file> [--stats]\n"
             "\tOR\n"
-            "\tpython3 main.py TDA <tda-file> <words-file>\n"
+            "\tpython3 main.py TDA <tda-file> <words-file> [--stats]\n"
             "\tOR\n"
             "\tpython3 main.py PARSE <regex-str>\n"
         )
@@ -32,32 +36,19 @@ if __name__ == "__main__":
         if sys.argv[1] == "PARSE":
             print(str(parsed_regex))
             sys.exit(0)
-    regular_expression = regular_expression.regex_to_regular_expression(parsed_regex)
-    nfa = Nfa.re_to_nfa(regular_expression)
-    dfa = dfa.nfa_to_dfa(nfa)
-
-    """print(dfa.alphabet)
-    print(dfa.start_state)
-    print(dfa.states)
-    print(dfa.final_states)
-    print(dfa.delta)"""
+    dfa = pipeline.compile_regex(parsed_regex, stats)
+    if stats is not None:
+        # Memory is measured in a second pass so that tracing allocations
+        # does not distort the wall times of the first one.
+        memory_stats = Stats.Stats(trace_memory=True)
+        pipeline.compile_regex(parsed_regex, memory_stats)
+        stats.merge_stages(memory_stats)
 
     with open(sys.argv[3], "r") as fin:
         content = fin.readlines()
 
     for word in content:
-        newword = list(word)
-        crt = dfa.start_state
-        ok = False
-        for c in newword:
-            if c != '\n':
-                crt = dfa.delta.get((crt, c))
-                if crt == None:
-                    print("False")
-                    ok = True
-                    break
-        if ok == False:
-            if crt in dfa.final_states:
-                print("True")
-            else:
-                print("False")
\ No newline at end of file
+        print(dfa.accepts(word.rstrip("\n"), stats))
+
+    if stats is not None:
+        sys.stderr.write(stats.to_json() + "\n")
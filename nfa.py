@@ -1,9 +1,4 @@
 #!/usr/bin/env python
-try:
-    from graphviz import Digraph
-except ImportError:
-    pass
-
 import regular_expression
 
 
@@ -37,6 +32,8 @@ class NFA(object):
         self.delta = delta
 
     def to_graphviz(self):
+        from graphviz import Digraph
+
         def get_edges(delta):
             edges = {}
             for (prev_state, word), next_states in delta.items():
@@ -101,7 +98,9 @@ class NFA(object):
 
 
 def rename_states(target, reference):
-    off = max(reference.states) + 1
+    shift_states(target, max(reference.states) + 1)
+
+def shift_states(target, off):
     target.start_state += off
     target.states = set(map(lambda s: s + off, target.states))
     target.final_states = set(map(lambda s: s + off, target.final_states))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+from contextlib import nullcontext
+
+import dfa as Dfa
+import nfa as Nfa
+import regular_expression
+import stats as Stats
+
+
+def no_stage(name):
+    return nullcontext()
+
+
+def compile_regex(regex, stats=None, minimize=True, limits=None, fallback=True):
+    """Run a RegEx TDA through all the transformations and return the DFA
+
+    When "stats" is a Stats object, each stage is measured and the sizes of
+    the intermediate results are recorded in it.
+
+    When "limits" is given and the subset construction exceeds it, a LazyDFA
+    over the NFA is returned instead if "fallback" is set; otherwise the
+    BudgetExceeded exception is propagated.
+
+    """
+    stage = no_stage if stats is None else stats.stage
+
+    if stats is not None:
+        stats.set("regex_nodes", Stats.tree_size(regex))
+    with stage("regex_to_regular_expression"):
+        re = regular_expression.regex_to_regular_expression(regex)
+
+    if stats is not None:
+        stats.set("regular_expression_nodes", Stats.tree_size(re))
+    with stage("re_to_nfa"):
+        nfa = Nfa.re_to_nfa(re)
+
+    if stats is not None:
+        stats.set("nfa_states", len(nfa.states))
+        stats.set("nfa_edges", sum(len(v) for v in nfa.delta.values()))
+    try:
+        with stage("nfa_to_dfa"):
+            dfa = Dfa.nfa_to_dfa(nfa, stats, limits)
+    except Dfa.BudgetExceeded:
+        if stats is not None:
+            stats.count("budget_exceeded")
+        if not fallback:
+            raise
+        return Dfa.LazyDFA(nfa)
+
+    if minimize:
+        with stage("minimize"):
+            dfa = Dfa.minimize(dfa, stats)
+    return dfa
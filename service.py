@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+import asyncio
+import json
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import dfa as Dfa
+import pipeline
+import regex as Regex
+
+DEFAULT_LIMITS = Dfa.Limits(max_states=10000, max_transitions=100000,
+                            max_time=5.0)
+
+# Compiled automata of the current worker process, least recently used first.
+# Thread pool workers share them, hence the lock.
+automata = OrderedDict()
+automata_lock = threading.Lock()
+
+
+def compile_pattern(key, regex, limits, max_patterns):
+    dfa = pipeline.compile_regex(regex, limits=limits)
+    with automata_lock:
+        automata[key] = dfa
+        while len(automata) > max_patterns:
+            automata.popitem(last=False)
+    return dfa
+
+
+def match_words(key, words, regex=None, limits=None, max_patterns=None):
+    """Match "words" against the automaton cached under "key" in this worker
+
+    Returns None if the worker has not compiled that pattern and "regex" was
+    not sent along; the caller then retries with "regex".
+
+    """
+    with automata_lock:
+        dfa = automata.get(key)
+        if dfa is not None:
+            automata.move_to_end(key)
+    if dfa is None:
+        if regex is None:
+            return None
+        dfa = compile_pattern(key, regex, limits, max_patterns)
+    return [dfa.accepts(word) for word in words]
+
+
+TYPE_NAMES = {
+    Regex.EMPTY_STRING: "EMPTY_STRING",
+    Regex.SYMBOL_SIMPLE: "SYMBOL_SIMPLE",
+    Regex.SYMBOL_ANY: "SYMBOL_ANY",
+    Regex.SYMBOL_SET: "SYMBOL_SET",
+    Regex.MAYBE: "MAYBE",
+    Regex.STAR: "STAR",
+    Regex.PLUS: "PLUS",
+    Regex.RANGE: "RANGE",
+    Regex.CONCATENATION: "CONCATENATION",
+    Regex.ALTERNATION: "ALTERNATION",
+}
+TYPES = {name: type for type, name in TYPE_NAMES.items()}
+
+
+def regex_to_json(regex):
+    """Encode a RegEx TDA as JSON-compatible objects
+
+    A node is {"type": <type name>} plus the members its type defines:
+    "symbol", "symbol_set" (a list of symbols and [first, last] ranges),
+    "range" (a [min, max] list), "lhs" and "rhs". Symbol sets are sorted,
+    so equal trees always have the same encoding.
+
+    """
+    node = {"type": TYPE_NAMES[regex.type]}
+    if regex.type == Regex.SYMBOL_SIMPLE:
+        node["symbol"] = regex.symbol
+    elif regex.type == Regex.SYMBOL_SET:
+        node["symbol_set"] = sorted(
+            (e if isinstance(e, str) else list(e) for e in regex.symbol_set),
+            key=lambda e: (isinstance(e, list), e))
+    elif hasattr(regex, "lhs"):
+        node["lhs"] = regex_to_json(regex.lhs)
+        if regex.type == Regex.RANGE:
+            node["range"] = list(regex.range)
+        if hasattr(regex, "rhs"):
+            node["rhs"] = regex_to_json(regex.rhs)
+    return node
+
+
+def regex_from_json(node):
+    if node.get("type") not in TYPES:
+        raise ValueError("unknown RegEx type {!r}".format(node.get("type")))
+    type = TYPES[node["type"]]
+    if type == Regex.SYMBOL_SIMPLE:
+        return Regex.RegEx(type, node["symbol"])
+    if type == Regex.SYMBOL_SET:
+        return Regex.RegEx(type, {e if isinstance(e, str) else tuple(e)
+                                  for e in node["symbol_set"]})
+    if type in (Regex.EMPTY_STRING, Regex.SYMBOL_ANY):
+        return Regex.RegEx(type)
+    lhs = regex_from_json(node["lhs"])
+    if type == Regex.RANGE:
+        return Regex.RegEx(type, lhs, tuple(node["range"]))
+    if type in (Regex.CONCATENATION, Regex.ALTERNATION):
+        return Regex.RegEx(type, lhs, regex_from_json(node["rhs"]))
+    return Regex.RegEx(type, lhs)
+
+
+def pattern_key(regex, limits):
+    """Identify a pattern compiled under "limits"
+
+    Unlike str(regex), the key is distinct for distinct trees: "a+" is the
+    string of both PLUS(a) and CONCATENATION(a, PLUS(EMPTY_STRING)), which
+    do not accept the same words.
+
+    """
+    if limits is not None:
+        limits = (limits.max_states, limits.max_transitions, limits.max_time)
+    return json.dumps([regex_to_json(regex), limits], sort_keys=True)
+
+
+def check_words(words):
+    if isinstance(words, str) or not isinstance(words, (list, tuple)) or \
+       not all(isinstance(word, str) for word in words):
+        raise TypeError("words must be a list of strings")
+
+
+def to_regex(pattern):
+    """Accept a RegEx TDA, its JSON encoding or a regex string
+
+    Regex strings need the "parse" module of the full build.
+
+    """
+    if isinstance(pattern, str):
+        import parse
+        return parse.parse(pattern)
+    if isinstance(pattern, dict):
+        return regex_from_json(pattern)
+    return pattern
+
+
+class MatcherService(object):
+    """Long-lived matcher backed by a pool of compiled automata
+
+    The service is used from asyncio code:
+
+        async with MatcherService() as service:
+            results = await service.match(pattern, words)
+
+    where "pattern" is anything to_regex accepts, "words" is a list of
+    strings and "results" is a list of booleans, one per word. Invalid
+    input fails only the request that carries it.
+
+    Requests arriving within "batch_window" seconds of each other are
+    grouped by pattern. Compiling and matching both run in "executor" (a
+    process pool by default), so the event loop is never blocked by them.
+    Every worker keeps the automata it compiled, at most "max_patterns" of
+    them, so a batch only carries the pattern key and the words; the
+    pattern itself is sent again only to a worker that has not compiled it
+    yet. Patterns are compiled under "limits", which protects the workers
+    from patterns with huge DFAs. The executor may also be a thread pool;
+    services sharing one only share automata compiled under equal limits.
+
+    """
+    def __init__(self, max_patterns=256, batch_window=0.002,
+                 limits=DEFAULT_LIMITS, executor=None):
+        """See class docstring"""
+        self.max_patterns = max_patterns
+        self.batch_window = batch_window
+        self.limits = limits
+        self.executor = executor
+        self.own_executor = executor is None
+        self.pending = {}
+        self.batch_scheduled = False
+        self.tasks = set()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor()
+
+    async def close(self):
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.own_executor and self.executor is not None:
+            executor, self.executor = self.executor, None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, executor.shutdown)
+
+    async def match(self, pattern, words):
+        check_words(words)
+        regex = to_regex(pattern)
+        key = pattern_key(regex, self.limits)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if key not in self.pending:
+            self.pending[key] = (regex, [])
+        self.pending[key][1].append((list(words), future))
+        if not self.batch_scheduled:
+            self.batch_scheduled = True
+            task = loop.create_task(self.flush_later())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return await future
+
+    async def flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self.batch_scheduled = False
+        pending, self.pending = self.pending, {}
+        await asyncio.gather(*[self.run_batch(key, regex, requests)
+                               for key, (regex, requests) in pending.items()])
+
+    async def run_batch(self, key, regex, requests):
+        words = []
+        for request_words, _ in requests:
+            words.extend(request_words)
+
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, match_words,
+                                                 key, words)
+            if results is None:
+                results = await loop.run_in_executor(
+                    self.executor, match_words, key, words, regex,
+                    self.limits, self.max_patterns)
+        except Exception as e:
+            for _, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        i = 0
+        for request_words, future in requests:
+            if not future.done():
+                future.set_result(results[i:i + len(request_words)])
+            i += len(request_words)
+
+
+async def handle_line(service, line):
+    """Answer one request of the line protocol
+
+    A request is a JSON object {"id": ..., "pattern": ..., "words": [...]}
+    where "pattern" is a JSON-encoded RegEx TDA (see regex_to_json) or a
+    regex string; the response is {"id": ..., "results": [...]} or
+    {"id": ..., "error": <message>}.
+
+    """
+    request = None
+    try:
+        request = json.loads(line)
+        results = await service.match(request["pattern"], request["words"])
+        response = {"id": request.get("id"), "results": results}
+    except Exception as e:
+        request_id = request.get("id") if isinstance(request, dict) else None
+        response = {"id": request_id, "error": str(e)}
+    return json.dumps(response)
+
+
+async def serve_stream(service, reader, writer):
+    """Serve the line protocol on an asyncio stream pair
+
+    Requests are handled concurrently, so responses may come out of order;
+    the "id" member is used to pair them with their requests.
+
+    """
+    async def answer(line):
+        writer.write((await handle_line(service, line) + "\n").encode())
+        await writer.drain()
+
+    tasks = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        task = asyncio.ensure_future(answer(line.decode()))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    writer.close()
+
+
+async def serve_stdin(service):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def answer(line):
+        sys.stdout.write(await handle_line(service, line) + "\n")
+        sys.stdout.flush()
+
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if not line.strip():
+            continue
+        task = loop.create_task(answer(line))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def main(socket_path=None, limits=DEFAULT_LIMITS):
+    async with MatcherService(limits=limits) as service:
+        if socket_path is None:
+            await serve_stdin(service)
+            return
+
+        server = await asyncio.start_unix_server(
+            lambda reader, writer: serve_stream(service, reader, writer),
+            path=socket_path)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    options = {"--socket": None, "--max-states": DEFAULT_LIMITS.max_states,
+               "--max-transitions": DEFAULT_LIMITS.max_transitions,
+               "--max-time": DEFAULT_LIMITS.max_time}
+    args = sys.argv[1:]
+    valid = len(args) % 2 == 0
+    try:
+        for option, value in zip(args[::2], args[1::2]):
+            if option not in options:
+                valid = False
+            elif option == "--socket":
+                options[option] = value
+            elif option == "--max-time":
+                options[option] = float(value)
+            else:
+                options[option] = int(value)
+    except ValueError:
+        valid = False
+    if not valid:
+        sys.stderr.write(
+            "Usage:\n"
+            "\tpython3 service.py [--socket <path>] [--max-states <n>]\n"
+            "\t                  [--max-transitions <n>] [--max-time <seconds>]\n"
+        )
+        sys.exit(1)
+
+    limits = Dfa.Limits(options["--max-states"], options["--max-transitions"],
+                        options["--max-time"])
+    asyncio.run(main(options["--socket"], limits))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+def tree_size(root):
+    """Count the nodes of a RegEx or RegularExpression tree"""
+    size = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        size += 1
+        if hasattr(node, "lhs"):
+            stack.append(node.lhs)
+        if hasattr(node, "rhs"):
+            stack.append(node.rhs)
+    return size
+
+
+class Stats(object):
+    """Collect instrumentation data for the regex -> DFA pipeline
+
+    The object contains the following:
+
+        - "stages": a dictionary from stage names to measurements
+                {stage: {"wall_time": seconds, "peak_memory": bytes}}
+            where "peak_memory" is the highest amount of memory traced while
+            the stage was running
+        - "counters": a dictionary from counter names to integers (AST node
+            counts, NFA/DFA sizes, epsilon closure invocations, characters
+            consumed while matching and so on)
+
+    Tracing allocations slows every stage down several times, so a Stats
+    object either measures wall time or, when "trace_memory" is set, peak
+    memory. To get both, run the pipeline once with each kind of object and
+    merge them.
+
+    Every function of the pipeline takes an optional "stats" argument; when
+    it is None nothing is measured.
+
+    """
+    def __init__(self, trace_memory=False):
+        """See class docstring"""
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.counters = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the wall time or the peak memory of a pipeline stage"""
+        measurements = self.stages.setdefault(name, {})
+        if not self.trace_memory:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                measurements["wall_time"] = time.perf_counter() - start
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            measurements["peak_memory"] = max(peak - base, 0)
+
+    def merge_stages(self, other):
+        """Add the stage measurements of "other" to this object"""
+        for name, measurements in other.stages.items():
+            self.stages.setdefault(name, {}).update(measurements)
+
+    def to_dict(self):
+        return {"stages": dict(self.stages), "counters": dict(self.counters)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=4, sort_keys=True)